@@ -1,12 +1,13 @@
 import streamlit as st
-import docx
-from docx.shared import Pt, Inches, Cm
-from docx.oxml.ns import qn
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_TABLE_ALIGNMENT
+import numpy as np
+import pandas as pd
 import random
 import io
+import zipfile
+import posixpath
+import hashlib
 import re
+import sys
 
 # ==========================================
 # 頁面與常數設定
@@ -17,220 +18,511 @@ st.set_page_config(
     page_icon="🧲"
 )
 
-SOURCES = ["一般試題", "學測題", "分科測驗", "北模", "全模", "中模"]
+SOURCES = ("一般試題", "學測題", "分科測驗", "北模", "全模", "中模")
 
 PHYSICS_CHAPTERS = {
-    "第一章.科學的態度與方法": [
+    "第一章.科學的態度與方法": (
         "1-1 科學的態度", "1-2 科學的方法", "1-3 國際單位制", "1-4 物理學簡介"
-    ],
-    "第二章.物體的運動": [
+    ),
+    "第二章.物體的運動": (
         "2-1 物體的運動", "2-2 牛頓三大運動定律", "2-3 生活中常見的力", "2-4 天體運動"
-    ],
-    "第三章. 物質的組成與交互作用": [
+    ),
+    "第三章. 物質的組成與交互作用": (
         "3-1 物質的組成", "3-2 原子的結構", "3-3 基本交互作用"
-    ],
-    "第四章.電與磁的統一": [
+    ),
+    "第四章.電與磁的統一": (
         "4-1 電流磁效應", "4-2 電磁感應", "4-3 電與磁的整合", "4-4 光波的特性", "4-5 都卜勒效應"
-    ],
-    "第五章. 能　量": [
+    ),
+    "第五章. 能　量": (
         "5-1 能量的形式", "5-2 微觀尺度下的能量", "5-3 能量守恆", "5-4 質能互換"
-    ],
-    "第六章.量子現象": [
+    ),
+    "第六章.量子現象": (
         "6-1 量子論的誕生", "6-2 光的粒子性", "6-3 物質的波動性", "6-4 波粒二象性", "6-5 原子光譜"
-    ]
+    )
+}
+CHAPTER_NAMES = tuple(PHYSICS_CHAPTERS)
+
+# Tab 3 篩選用、與題庫平行保存的欄位表 (pool_df) 欄位；分類欄位以 category 儲存
+POOL_COLUMNS = ('id', 'type', 'source', 'chapter', 'unit')
+POOL_CATEGORY_COLUMNS = ('type', 'source', 'chapter', 'unit')
+
+# Tab 3 詳細面板的編輯元件：同時只編輯一題，鍵固定不帶題目 id
+EDIT_WIDGET_KEYS = ('edit_mode', 'e_src', 'e_chap', 'e_unit', 'e_content', 'e_opts', 'e_ans')
+
+# Tab 3 表格的單元下拉選單，以及由單元反查所屬章節
+ALL_UNITS = tuple(unit for units in PHYSICS_CHAPTERS.values() for unit in units)
+UNIT_TO_CHAPTER = {unit: chap for chap, units in PHYSICS_CHAPTERS.items() for unit in units}
+
+# 編輯面板下拉選單的預設位置：值 -> 索引，取代逐一 list.index 搜尋
+SOURCE_INDEX = {src: i for i, src in enumerate(SOURCES)}
+CHAPTER_INDEX = {chap: i for i, chap in enumerate(PHYSICS_CHAPTERS)}
+UNIT_INDEX = {chap: {unit: i for i, unit in enumerate(units)} for chap, units in PHYSICS_CHAPTERS.items()}
+
+# Tab 3 預覽圖的顯示寬度 (px)；縮圖只限制寬度，高度依比例
+THUMB_SIZE = 300
+
+# 匯出 Word 檔的 MIME 類型
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Word XML 命名空間與解析用的常數
+DOCX_NSMAP = {
+    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
 }
+W_BODY = f"{{{DOCX_NSMAP['w']}}}body"
+W_P = f"{{{DOCX_NSMAP['w']}}}p"
+W_R = f"{{{DOCX_NSMAP['w']}}}r"
+W_RPR = f"{{{DOCX_NSMAP['w']}}}rPr"
+W_B = f"{{{DOCX_NSMAP['w']}}}b"
+W_I = f"{{{DOCX_NSMAP['w']}}}i"
+W_T = f"{{{DOCX_NSMAP['w']}}}t"
+W_BR = f"{{{DOCX_NSMAP['w']}}}br"
+W_TAB = f"{{{DOCX_NSMAP['w']}}}tab"
+W_EAST_ASIA = f"{{{DOCX_NSMAP['w']}}}eastAsia"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+BLIP_TAG = f"{{{DOCX_NSMAP['a']}}}blip"
+EMBED_ATTR = f"{{{DOCX_NSMAP['r']}}}embed"
+
+# .docx 套件內的關聯檔 (*.rels)
+PKG_REL_TAG = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+RT_OFFICE_DOCUMENT = f"{DOCX_NSMAP['r']}/officeDocument"
+RT_IMAGE = f"{DOCX_NSMAP['r']}/image"
+
+# 段落開頭的標籤：[Src:..] [Chap:..] [Unit:..] [Cat:..] [Type:..] 需帶值，[Q] [Opt] [Ans] 不帶值；
+# 帶值標籤缺少右括號時 (group 3 為 None)，值取到段落結尾
+TAG_RE = re.compile(r'^\[(?:(Src|Chap|Unit|Cat|Type):([^\]]*)(\])?|(Q|Opt|Ans)\])\s*(.*)$', re.S)
+
+# 選項代號 A, B, C...；代號的索引直接以 ord(代號) - ORD_A 計算
+ORD_A = ord('A')
+LETTERS = [chr(ORD_A + i) for i in range(26)]
+# 試卷與預覽共用的選項前綴 "(A) "、"(B) "...
+OPT_PREFIXES = tuple(f"({c}) " for c in LETTERS)
+
+# 題型顯示文字
+Q_TYPE_TEXT = {'Single': '單選', 'Multi': '多選', 'Fill': '填充'}
+Q_TYPE_BADGE = {'Single': '🟢單選', 'Multi': '🔵多選', 'Fill': '🟠填充'}
+
+# 寫入 Word 時需轉成 <w:br/>、<w:tab/> 的字元
+RUN_SPECIAL_CHARS = re.compile(r'(\n|\t)')
+
+# 選項前綴，例如 "(A) "、"B."、"c、"
+OPT_PATTERN = re.compile(r'^\s*\(?[A-Ea-e]\)?\s*[.、]?\s*')
+
+# \( \) 與 \[ \] 公式標記 (ChatGPT 等來源常見) 轉成 Streamlit markdown 認得的 $ 與 $$；
+# 前一個字元也是反斜線時 (如 \\[2pt] 換行) 不轉換
+LATEX_DELIM_RE = re.compile(r'(?<!\\)\\([()\[\]])')
+LATEX_DELIM_MAP = {'(': '$', ')': '$', '[': '$$', ']': '$$'}
 
 # ==========================================
 # 核心邏輯類別與函式
 # ==========================================
 
 class Question:
+    # 題庫可能有上千題存放在 session_state，以 __slots__ 省去每個物件的 __dict__
+    __slots__ = ('id', 'type', 'source', 'chapter', 'unit', '_content', 'preview', 'options', 'answer', 'image_data')
+
     def __init__(self, q_type, content, options=None, answer=None, original_id=0, image_data=None, 
                  source="一般試題", chapter="", unit=""):
         self.id = original_id
-        self.type = q_type  # 'Single', 'Multi', 'Fill'
+        self.type = sys.intern(q_type)  # 'Single', 'Multi', 'Fill'
         self.source = source
         self.chapter = chapter
         self.unit = unit
         self.content = content
-        self.options = options if options else []
+        self.options = options if options is not None else []
         self.answer = answer
-        self.image_data = image_data
+        self.image_data = image_data  # 加入題庫後為圖片庫的鍵 (見 store_image)
+
+    @property
+    def content(self):
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        # 同步更新 Tab 3 標題用的預覽 (題幹第一行前 20 字)，避免每次重繪都重新切割全文
+        self._content = value
+        self.preview = value.strip().split('\n', 1)[0][:20]
+
+def normalize_latex_delimiters(text):
+    """將 \\( \\) / \\[ \\] 公式標記換成 $ / $$；在匯入與儲存時做一次，顯示時不必再處理"""
+    if '\\' not in text:
+        return text
+    return LATEX_DELIM_RE.sub(lambda m: LATEX_DELIM_MAP[m.group(1)], text)
+
+def store_image(blob):
+    """將圖片存入工作階段的圖片庫並回傳其 SHA-1 鍵；相同圖片只存一份"""
+    key = hashlib.sha1(blob).digest()
+    st.session_state['image_store'].setdefault(key, blob)
+    return key
+
+def load_image(key):
+    """依 store_image 回傳的鍵取回圖片 bytes"""
+    if key is None:
+        return None
+    return st.session_state['image_store'].get(key)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_thumbnail(key):
+    """取回圖片並縮成寬度不超過 THUMB_SIZE 的預覽圖，避免每次重繪都把原圖送到瀏覽器
+
+    以圖片庫的鍵為快取鍵 (相同圖片共用縮圖)；已夠小或無法解碼的圖片直接回傳原圖。
+    """
+    from PIL import Image  # 延遲載入：只有預覽附圖時才需要
+
+    blob = load_image(key)
+    if blob is None:
+        return None
+    try:
+        im = Image.open(io.BytesIO(blob))
+        if im.width <= THUMB_SIZE:
+            return blob
+        # 預覽以 width=THUMB_SIZE 顯示，高度不設上限；限制高度會讓細長的圖被放大而模糊
+        im.thumbnail((THUMB_SIZE, sys.maxsize))
+        buf = io.BytesIO()
+        # 有透明度的圖 (如 PNG 示意圖) 轉 JPEG 會變黑底，保留 PNG
+        if 'A' in im.getbands() or 'transparency' in im.info:
+            im.convert('RGBA').save(buf, 'PNG', optimize=True)
+        else:
+            im.convert('RGB').save(buf, 'JPEG', quality=80)
+        return buf.getvalue()
+    except Exception as e:
+        print(f"Thumbnail warning: {e}")
+        return blob
+
+def read_part_rels(zf, part_name):
+    """讀取 .docx 內某組件的關聯檔，回傳 {rId: (關聯類型, 目標組件路徑)}；外部連結略過
+
+    part_name 為空字串時讀取套件根目錄的 _rels/.rels
+    """
+    from lxml import etree
+
+    base, name = posixpath.split(part_name)
+    try:
+        rels_xml = zf.read(posixpath.join(base, '_rels', name + '.rels'))
+    except KeyError:
+        return {}
+
+    rels = {}
+    # 上傳的檔案不可信任：與 python-docx 相同不展開 DTD 實體，也不連網讀取外部資源
+    parser = etree.XMLParser(resolve_entities=False, no_network=True)
+    for rel in etree.fromstring(rels_xml, parser).iter(PKG_REL_TAG):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target', '')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(base, target))
+        rels[rel.get('Id')] = (rel.get('Type'), target)
+    return rels
+
+def find_main_document_part(zf):
+    """由套件關聯找出主文件組件的路徑 (通常是 word/document.xml)"""
+    for rel_type, target in read_part_rels(zf, '').values():
+        if rel_type == RT_OFFICE_DOCUMENT:
+            return target
+    return 'word/document.xml'
+
+def extract_images_from_paragraph(p_el, zf, image_targets, blob_cache):
+    """取出段落 (含其中的文字方塊等巢狀內容) 引用的圖片 bytes，依出現順序回傳
 
-def extract_images_from_paragraph(paragraph, doc_part):
-    """從 Word 段落中擷取圖片"""
+    image_targets: {rId: 圖片組件路徑}；blob_cache: rId -> 圖片 bytes，同一張圖被多處引用時只讀取一次
+    """
     images = []
-    nsmap = {
-        'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
-        'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
-    }
-    # 嘗試尋找 blip 元素 (圖片參照)
     try:
-        blips = paragraph._element.findall('.//a:blip', namespaces=nsmap)
-        for blip in blips:
-            embed_attr = blip.get(f"{{{nsmap['r']}}}embed")
-            if embed_attr and embed_attr in doc_part.rels:
-                part = doc_part.rels[embed_attr].target_part
-                if "image" in part.content_type:
-                    images.append(part.blob)
+        for blip in p_el.iter(BLIP_TAG):
+            embed_attr = blip.get(EMBED_ATTR)
+            if not embed_attr:
+                continue
+
+            if embed_attr not in blob_cache:
+                target = image_targets.get(embed_attr)
+                blob_cache[embed_attr] = zf.read(target) if target else None
+
+            blob = blob_cache[embed_attr]
+            if blob is not None:
+                images.append(blob)
     except Exception as e:
         # 容錯處理
         print(f"Image extraction warning: {e}")
     return images
 
-def parse_docx(file_bytes):
-    """解析 Word 檔案 (支援 Source, Chapter, Unit 標籤，增強同一行標籤解析)"""
+class ParseState:
+    """parse_docx 逐段解析時的狀態 (分類標籤會延續到下一題)"""
+    def __init__(self):
+        self.questions = []
+        self.current_q = None
+        self.state = None  # 'Q', 'Opt', 'Ans'
+        self.q_id_counter = 1
+        self.src = "一般試題"
+        self.chap = ""
+        self.unit = ""
+        # 目前題目的題幹與答案片段，完成該題時才一次串接
+        self.content_parts = []
+        self.answer_parts = []
+
+    def finish_question(self):
+        q = self.current_q
+        if q:
+            if self.content_parts:
+                q.content = "\n".join(self.content_parts) + "\n"
+            q.answer = "".join(self.answer_parts)
+            self.questions.append(q)
+        self.current_q = None
+        self.content_parts = []
+        self.answer_parts = []
+
+# 標籤處理函式：回傳需要當作內容繼續處理的文字，None 表示此段落已處理完畢；
+# 標籤後同一行的文字 (例如 [Src:北模][Chap:...]) 再交給 apply_tag 處理
+def handle_src_tag(ps, value, rest):
+    ps.src = value.strip()
+    return apply_tag(ps, rest) if rest else None
+
+def handle_chap_tag(ps, value, rest):
+    ps.chap = value.strip()
+    return apply_tag(ps, rest) if rest else None
+
+def handle_unit_tag(ps, value, rest):
+    ps.unit = value.strip()
+    return apply_tag(ps, rest) if rest else None
+
+def handle_type_tag(ps, value, rest):
+    ps.finish_question()
+    ps.current_q = Question(
+        q_type=value.strip(),
+        content="",
+        options=[],
+        answer="",
+        original_id=ps.q_id_counter,
+        source=ps.src,
+        chapter=ps.chap,
+        unit=ps.unit
+    )
+    ps.q_id_counter += 1
+    ps.state = None
+    # 同一行可接著寫 [Q] / [Opt] / [Ans]
+    return apply_tag(ps, rest) if rest else None
+
+def handle_q_tag(ps, value, rest):
+    ps.state = 'Q'
+    return rest or None
+
+def handle_opt_tag(ps, value, rest):
+    ps.state = 'Opt'
+    return rest or None
+
+def handle_ans_tag(ps, value, rest):
+    ps.state = 'Ans'
+    if rest and ps.current_q:
+        ps.answer_parts = [rest]
+    return None
+
+TAG_HANDLERS = {
+    'Src': handle_src_tag,
+    'Chap': handle_chap_tag,
+    'Unit': handle_unit_tag,
+    'Cat': handle_unit_tag,  # 相容舊版
+    'Type': handle_type_tag,
+    'Q': handle_q_tag,
+    'Opt': handle_opt_tag,
+    'Ans': handle_ans_tag,
+}
+
+def apply_tag(ps, text):
+    """若段落以標籤開頭則交給對應的處理函式，否則原樣回傳文字"""
+    # 大多數段落是題目內文，首字不是 '[' 時不必進入正規表示式比對
+    if text[:1] != '[':
+        return text
+    m = TAG_RE.match(text)
+    if m is None:
+        return text
+    tag = m.group(1) or m.group(4)
+    value = m.group(2) or ""
+    if tag == 'Type' and m.group(3) is None:
+        value = "Single"  # 與舊版相同：[Type: 沒有右括號時視為單選題
+    return TAG_HANDLERS[tag](ps, value, m.group(5))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def parse_docx(file_like):
+    """解析 Word 檔案 (支援 Source, Chapter, Unit 標籤，增強同一行標籤解析)
+
+    file_like 可直接傳入 st.file_uploader 的 UploadedFile (可 seek 的檔案物件)，不另外複製整份 bytes。
+    以檔案名稱與內容為快取鍵，重複上傳同一份檔案時直接回傳先前的解析結果。
+    直接從 zip 串流讀取主文件 XML，逐段解析後即釋放，不建立整份 Document 物件樹。
+    """
+    # 延遲載入：只瀏覽題庫時不需要 python-docx；這裡只借用它的元素類別 (CT_P.text)
+    from docx.oxml.parser import element_class_lookup
+    from lxml import etree
+
     try:
-        doc = docx.Document(io.BytesIO(file_bytes))
-        doc_part = doc.part
+        file_like.seek(0)
+        zf = zipfile.ZipFile(file_like)
+        doc_part = find_main_document_part(zf)
+        image_targets = {rid: target for rid, (rel_type, target) in read_part_rels(zf, doc_part).items()
+                         if rel_type == RT_IMAGE}
+        xml_stream = zf.open(doc_part)
     except Exception as e:
         st.error(f"檔案讀取失敗，請確認是否為有效的 Word 檔 (.docx)。錯誤: {e}")
         return []
-    
-    questions = []
-    current_q = None
-    state = None
-    opt_pattern = re.compile(r'^\s*\(?[A-Ea-e]\)?\s*[.、]?\s*')
-    q_id_counter = 1
-
-    # 預設狀態 (會延續到下一題)
-    curr_src = "一般試題"
-    curr_chap = ""
-    curr_unit = ""
-
-    for para in doc.paragraphs:
-        text = para.text.strip()
-        found_images = extract_images_from_paragraph(para, doc_part)
-        
-        # 0. 偵測分類標籤 (Src, Chap, Unit)
-        if text.startswith('[Src:'):
-            curr_src = text.split(':')[1].replace(']', '').strip()
-            continue
-        if text.startswith('[Chap:'):
-            curr_chap = text.split(':')[1].replace(']', '').strip()
-            continue
-        if text.startswith('[Unit:'):
-            curr_unit = text.split(':')[1].replace(']', '').strip()
-            continue
-        if text.startswith('[Cat:'): # 相容舊版
-            curr_unit = text.split(':')[1].replace(']', '').strip()
-            continue
 
-        # 1. 偵測新題目 [Type:...]
-        if text.startswith('[Type:'):
-            if current_q: questions.append(current_q)
-            
-            # 解析 Type
-            end_idx = text.find(']')
-            if end_idx != -1:
-                q_type_str = text[6:end_idx].strip()
-                remaining_text = text[end_idx+1:].strip()
-            else:
-                q_type_str = "Single"
-                remaining_text = ""
-
-            current_q = Question(
-                q_type=q_type_str, 
-                content="", 
-                options=[], 
-                answer="", 
-                original_id=q_id_counter, 
-                source=curr_src,
-                chapter=curr_chap,
-                unit=curr_unit
-            )
-            q_id_counter += 1
-            state = None
-            
-            if remaining_text:
-                text = remaining_text
-            else:
-                continue
+    ps = ParseState()
+    blob_cache = {}
+    paragraphs = etree.iterparse(xml_stream, events=('end',), tag=W_P, resolve_entities=False, no_network=True)
+    paragraphs.set_element_class_lookup(element_class_lookup)
 
-        # 2. 狀態切換與單行內容處理
-        if text.startswith('[Q]'):
-            state = 'Q'
-            text = text[3:].strip()
-            if not text: continue
+    # 只處理 body 底下的 <w:p> (與 doc.paragraphs 相同範圍)；
+    # CT_P.text 會把 <w:tab/>、<w:br/> 轉成 \t、\n，行為與 Paragraph.text 一致
+    with zf, xml_stream:
+        try:
+            for _, p_el in paragraphs:
+                body = p_el.getparent()
+                if body is None or body.tag != W_BODY:
+                    continue  # 表格、文字方塊內的段落隨其頂層元素一起處理
 
-        elif text.startswith('[Opt]'):
-            state = 'Opt'
-            text = text[5:].strip()
-            if not text: continue
-            
-        elif text.startswith('[Ans]'):
-            state = 'Ans'
-            remain_text = text.replace('[Ans]', '').strip()
-            if remain_text and current_q: 
-                current_q.answer = remain_text
-            continue
+                # 釋放已處理過的頂層元素 (含表格)，記憶體中只保留目前這一段
+                while p_el.getprevious() is not None:
+                    del body[0]
 
-        # 3. 填入內容
-        if current_q:
-            if found_images and state == 'Q':
-                current_q.image_data = found_images[0]
+                text = p_el.text.strip()
 
-            if not text: continue
+                # 1. 分類標籤、題型與狀態切換 (單一正規表示式比對後查表分派)
+                text = apply_tag(ps, text)
+                if text is None:
+                    continue
 
-            if state == 'Q': 
-                current_q.content += text + "\n"
-            elif state == 'Opt':
-                clean_opt = opt_pattern.sub('', text)
-                current_q.options.append(clean_opt)
-            elif state == 'Ans': 
-                current_q.answer += text
+                # 2. 填入內容
+                current_q = ps.current_q
+                if current_q:
+                    state = ps.state
+                    if state == 'Q':
+                        found_images = extract_images_from_paragraph(p_el, zf, image_targets, blob_cache)
+                        if found_images:
+                            current_q.image_data = found_images[0]
 
-    if current_q: questions.append(current_q)
-    return questions
+                    if not text: continue
+                    text = normalize_latex_delimiters(text)
 
-def shuffle_options_and_update_answer(question):
-    """打亂選項並修正答案"""
-    if question.type == 'Fill': return question
+                    if state == 'Q': 
+                        ps.content_parts.append(text)
+                    elif state == 'Opt':
+                        clean_opt = OPT_PATTERN.sub('', text)
+                        current_q.options.append(clean_opt)
+                    elif state == 'Ans': 
+                        ps.answer_parts.append(text)
+        except etree.XMLSyntaxError as e:
+            st.error(f"檔案讀取失敗，請確認是否為有效的 Word 檔 (.docx)。錯誤: {e}")
+            return []
+
+    ps.finish_question()
+    return ps.questions
+
+def shuffle_options_and_update_answer(question, rng):
+    """打亂選項並修正答案，回傳 (新選項清單, 新答案)；其餘欄位沿用原題
+
+    rng: random.Random，由呼叫端決定種子
+    """
+    if question.type == 'Fill': return question.options, question.answer
+    # 0 或 1 個選項時沒有可打亂的內容
+    if len(question.options) < 2: return question.options, question.answer
 
     original_opts = question.options
     original_ans = question.answer.strip().upper()
-    char_to_idx = {chr(65+i): i for i in range(len(original_opts))}
-    
-    correct_indices = []
+    n = len(original_opts)
+
+    # 正確答案以位元遮罩表示：第 i 個位元代表原第 i 個選項 (重複的代號自然合併)
+    mask = 0
     for char in original_ans:
-        if char in char_to_idx: correct_indices.append(char_to_idx[char])
-            
-    correct_contents = [original_opts[i] for i in correct_indices]
-    
-    shuffled_opts_data = list(enumerate(original_opts))
-    random.shuffle(shuffled_opts_data)
-    new_options = [data[1] for data in shuffled_opts_data]
-    
-    new_ans_chars = []
-    for content in correct_contents:
-        try:
-            new_idx = new_options.index(content)
-            new_ans_chars.append(chr(65 + new_idx))
-        except ValueError: pass
+        idx = ord(char) - ORD_A
+        if 0 <= idx < n: mask |= 1 << idx
             
-    new_ans_chars.sort()
-    new_answer_str = "".join(new_ans_chars)
+    # 只產生索引排列 perm (perm[新位置] = 原索引)，再依序取出選項
+    perm = rng.sample(range(n), n)
+    new_options = [original_opts[i] for i in perm]
 
-    return Question(
-        question.type, question.content, new_options, new_answer_str, 
-        question.id, question.image_data, 
-        question.source, question.chapter, question.unit
-    )
+    # 沒有答案 (或答案代號都不在選項範圍內) 時只需打亂選項，不必換算答案
+    if not mask:
+        return new_options, ""
+
+    # 依新位置由小到大檢查原索引是否在遮罩中，得到的代號已排序，不需 sort()
+    new_answer_str = "".join(LETTERS[new_i] for new_i, old_i in enumerate(perm) if mask >> old_i & 1)
+
+    return new_options, new_answer_str
 
 def set_font(doc, font_name='Times New Roman', east_asia_font='DFKai-SB'):
     """設定整份文件的預設字型"""
+    from docx.shared import Pt
+
     style = doc.styles['Normal']
     style.font.name = font_name
     style.font.size = Pt(12)
-    style._element.rPr.rFonts.set(qn('w:eastAsia'), east_asia_font)
+    style._element.rPr.rFonts.set(W_EAST_ASIA, east_asia_font)
 
-def generate_word_files(selected_questions, shuffle=True, title="高中物理科 段考題"):
-    """生成 Word 試卷 (優化排版)"""
-    exam_doc = docx.Document()
-    ans_doc = docx.Document()
-    
-    set_font(exam_doc)
-    set_font(ans_doc)
+def fast_add_run(p, text, bold=False, italic=False):
+    """直接以 lxml 建立 <w:r> 並附加到段落元素 p (\\n、\\t 轉為 <w:br/>、<w:tab/>)
+
+    以 p.makeelement 建立子元素，沿用文件的 parser 與命名空間，不需匯入 python-docx。
+    """
+    new = p.makeelement
+    r = new(W_R)
+    if bold or italic:
+        rPr = new(W_RPR)
+        if bold: rPr.append(new(W_B))
+        if italic: rPr.append(new(W_I))
+        r.append(rPr)
+    for piece in RUN_SPECIAL_CHARS.split(text):
+        if piece == '\n':
+            r.append(new(W_BR))
+        elif piece == '\t':
+            r.append(new(W_TAB))
+        elif piece:
+            t = new(W_T, {XML_SPACE: 'preserve'})
+            t.text = piece
+            r.append(t)
+    p.append(r)
+    return r
+
+def fast_add_para(body, text="", bold=False):
+    """在文件末端 (sectPr 之前) 新增段落，略過 python-docx 的 Paragraph/Run 物件與樣式處理"""
+    p = body.add_p()
+    if text:
+        fast_add_run(p, text, bold=bold)
+    return p
+
+@st.cache_resource(show_spinner=False)
+def build_base_document_bytes():
+    """試題卷與詳解卷共用的空白文件 (已設定字型)；整個伺服器程序只建立一次"""
+    import docx
+
+    doc = docx.Document()
+    set_font(doc)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+def question_cache_key(q):
+    """題目內容的可雜湊表示，供 st.cache_data 判斷匯出結果是否可重用"""
+    return (q.id, q.type, q.content, tuple(q.options), q.answer, q.source, q.chapter, q.unit, q.image_data)
+
+@st.cache_data(ttl=60 * 60, max_entries=4, show_spinner=False)
+def _generate_word_files(question_keys, _selected_questions, _images, shuffle=True, title="高中物理科 段考題", seed=0):
+    """生成 Word 試卷 (優化排版)，回傳 (試題卷 bytes, 詳解卷 bytes)；請透過 generate_word_files 呼叫
+
+    選項洗牌使用以 seed 建立的 random.Random，相同題目、設定與種子會得到相同結果，
+    因此以 st.cache_data 快取，重複點擊生成時不必重建文件；一小時未使用的結果自動釋放。
+    question_keys 為各題的 question_cache_key()；_selected_questions 與 _images (圖片庫) 不參與雜湊。
+    按下下載時在背景執行緒呼叫、無法讀取 session_state，圖片庫須由呼叫端傳入。
+    """
+    import docx
+    from docx.shared import Inches
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.enum.table import WD_TABLE_ALIGNMENT
+
+    rng = random.Random(seed)
+    # 兩份文件都從已設定好字型的空白文件開啟，不必每次重新套用 set_font
+    base_doc_bytes = build_base_document_bytes()
+    exam_doc = docx.Document(io.BytesIO(base_doc_bytes))
+    ans_doc = docx.Document(io.BytesIO(base_doc_bytes))
     
     # === 試題卷檔頭設計 ===
     title_p = exam_doc.add_heading(title, 0)
@@ -252,60 +544,254 @@ def generate_word_files(selected_questions, shuffle=True, title="高中物理科
     ans_doc.add_heading(f'{title} - 詳解卷', 0)
     ans_doc.add_paragraph('此卷包含答案與詳細分類資訊。\n')
 
+    exam_body = exam_doc.element.body
+    ans_body = ans_doc.element.body
+    pic_width = Inches(3.5)  # 附圖寬度 (EMU)，迴圈外換算一次
+
     # === 題目內容 ===
-    for idx, q in enumerate(selected_questions, 1):
-        processed_q = q
+    for idx, q in enumerate(_selected_questions, 1):
+        options, answer = q.options, q.answer
         if shuffle and q.type in ['Single', 'Multi']:
-            processed_q = shuffle_options_and_update_answer(q)
+            options, answer = shuffle_options_and_update_answer(q, rng)
         
         # --- 試題卷 ---
         p = exam_doc.add_paragraph()
-        q_type_text = {'Single': '單選', 'Multi': '多選', 'Fill': '填充'}.get(q.type, '未知')
+        q_type_text = Q_TYPE_TEXT.get(q.type, '未知')
         
-        runner = p.add_run(f"{idx}. ({q_type_text}) {processed_q.content.strip()}")
+        runner = p.add_run(f"{idx}. ({q_type_text}) {q.content.strip()}")
         runner.bold = True
         
-        if processed_q.image_data:
+        image_blob = _images.get(q.image_data)
+        if image_blob:
             try:
-                img_stream = io.BytesIO(processed_q.image_data)
-                exam_doc.add_picture(img_stream, width=Inches(3.5))
+                # BytesIO(bytes) 直接共用原 bytes 的緩衝區，不會複製圖片內容
+                exam_doc.add_picture(io.BytesIO(image_blob), width=pic_width)
             except Exception as e:
                 print(f"Error adding picture: {e}")
 
+        # 選項與答案行數量最多，直接建立 XML 元素
         if q.type != 'Fill':
-            for i, opt in enumerate(processed_q.options):
-                exam_doc.add_paragraph(f"({chr(65+i)}) {opt}")
+            for i, opt in enumerate(options):
+                fast_add_para(exam_body, OPT_PREFIXES[i] + opt)
         else:
-            exam_doc.add_paragraph("______________________")
+            fast_add_para(exam_body, "______________________")
         
-        exam_doc.add_paragraph("") 
+        fast_add_para(exam_body)
         
         # --- 答案卷 ---
-        ans_p = ans_doc.add_paragraph()
-        ans_p.add_run(f"{idx}. ").bold = True
-        ans_p.add_run(f"{processed_q.answer}")
+        ans_p = fast_add_para(ans_body, f"{idx}. ", bold=True)
+        if answer:
+            fast_add_run(ans_p, answer)
         
         meta_info = []
-        if processed_q.source and processed_q.source != "一般試題": meta_info.append(processed_q.source)
-        if processed_q.unit: meta_info.append(processed_q.unit)
-        elif processed_q.chapter: meta_info.append(processed_q.chapter)
+        if q.source and q.source != "一般試題": meta_info.append(q.source)
+        if q.unit: meta_info.append(q.unit)
+        elif q.chapter: meta_info.append(q.chapter)
             
         if meta_info:
-            ans_p.add_run(f"  [{' / '.join(meta_info)}]").italic = True
+            fast_add_run(ans_p, f"  [{' / '.join(meta_info)}]", italic=True)
 
-    exam_io = io.BytesIO()
-    ans_io = io.BytesIO()
-    exam_doc.save(exam_io)
-    ans_doc.save(ans_io)
-    exam_io.seek(0)
-    ans_io.seek(0)
-    return exam_io, ans_io
+    # 兩份文件共用同一個輸出緩衝區，各自 save() 一次後取出 bytes
+    buf = io.BytesIO()
+    exam_doc.save(buf)
+    exam_bytes = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    ans_doc.save(buf)
+    ans_bytes = buf.getvalue()
+    return exam_bytes, ans_bytes
+
+def generate_word_files(questions, images, shuffle=True, title="高中物理科 段考題", seed=0):
+    """生成 Word 試卷，回傳 (試題卷 bytes, 詳解卷 bytes)；由題目內容算出快取鍵，呼叫端不必自行組合"""
+    return _generate_word_files(
+        tuple(question_cache_key(q) for q in questions), questions, images, shuffle=shuffle, title=title, seed=seed
+    )
+
+def deferred_export(part, questions, shuffle, title, seed):
+    """回傳給 download_button 的延遲生成函式：按下下載時才呼叫 generate_word_files，part 0 為試題卷、1 為詳解卷"""
+    images = st.session_state['image_store']  # 在腳本執行緒先取得，下載時的執行緒讀不到 session_state
+    return lambda: generate_word_files(questions, images, shuffle=shuffle, title=title, seed=seed)[part]
 
 # ==========================================
 # Session State
 # ==========================================
+def make_pool_frame(questions):
+    """由題目建立篩選用的欄位表，每題一列、順序與 question_pool 相同"""
+    frame = pd.DataFrame({name: [getattr(q, name) for q in questions] for name in POOL_COLUMNS})
+    frame['id'] = frame['id'].astype('int64')
+    # 來源、章節、單元的種類很少：category 只存一份字串，各列存整數代碼
+    return frame.astype({name: 'category' for name in POOL_CATEGORY_COLUMNS})
+
 if 'question_pool' not in st.session_state:
     st.session_state['question_pool'] = []
+if 'pool_df' not in st.session_state:
+    # 與 question_pool 逐列對應的欄位表，Tab 3 篩選時以向量化比對取代逐題取屬性
+    st.session_state['pool_df'] = make_pool_frame([])
+if 'selected_ids' not in st.session_state:
+    st.session_state['selected_ids'] = set()  # Tab 3 勾選匯出的題目 id
+if 'delete_ids' not in st.session_state:
+    st.session_state['delete_ids'] = set()  # Tab 3 標記待刪除的題目 id
+if 'next_qid' not in st.session_state:
+    st.session_state['next_qid'] = 1
+if 'image_store' not in st.session_state:
+    st.session_state['image_store'] = {}  # SHA-1 -> 圖片 bytes，題目只保存鍵
+if 'shuffle_seed' not in st.session_state:
+    st.session_state['shuffle_seed'] = random.randrange(2**32)
+if 'editor_version' not in st.session_state:
+    # Tab 3 表格的鍵帶版本號；有鍵的 data_editor 只在欄位或列數改變時重設，
+    # 內容改變 (篩選、送出、全選、刪除) 時必須換鍵，舊的列編輯才不會套到別題
+    st.session_state['editor_version'] = 0
+    st.session_state['editor_qids'] = ()
+
+def add_to_pool(questions):
+    """將題目加入題庫：指派本次工作階段內唯一的 id、圖片改存入圖片庫，並預設為勾選匯出"""
+    first_id = st.session_state['next_qid']
+    for q_id, q in enumerate(questions, first_id):
+        if q.image_data is not None:
+            q.image_data = store_image(q.image_data)
+        q.id = q_id
+    st.session_state['next_qid'] = first_id + len(questions)
+    st.session_state['question_pool'].extend(questions)
+    st.session_state['selected_ids'].update(range(first_id, first_id + len(questions)))
+
+    # 欄位表整批串接一次；兩邊的 category 種類不同時 concat 會退回 object，需重新轉回 category
+    df = st.session_state['pool_df']
+    new_rows = make_pool_frame(questions)
+    if len(df):
+        new_rows = pd.concat([df, new_rows], ignore_index=True).astype(
+            {name: 'category' for name in POOL_CATEGORY_COLUMNS})
+    st.session_state['pool_df'] = new_rows
+
+def remove_from_pool(qids):
+    """一次刪除題庫中 id 在 qids 內的題目，並同步篩選欄位、勾選狀態與圖片庫"""
+    df = st.session_state['pool_df']
+    keep = ~df['id'].isin(qids).to_numpy()
+    st.session_state['question_pool'] = [q for q, k in zip(st.session_state['question_pool'], keep) if k]
+    st.session_state['pool_df'] = df[keep].reset_index(drop=True)
+    st.session_state['selected_ids'].difference_update(qids)
+    # 已無任何題目使用的圖片一併移除
+    images = st.session_state['image_store']
+    in_use = {q.image_data for q in st.session_state['question_pool'] if q.image_data is not None}
+    for key in images.keys() - in_use:
+        del images[key]
+
+def sync_pool_frame(idx):
+    """第 idx 題的分類被編輯後，更新對應的篩選欄位"""
+    q = st.session_state['question_pool'][idx]
+    df = st.session_state['pool_df']
+    for name in ('source', 'chapter', 'unit'):
+        value = getattr(q, name)
+        col = df[name]
+        if value not in col.cat.categories:
+            col = col.cat.add_categories([value])
+        # category 欄位的代碼陣列可能是唯讀的共用緩衝區，複製後再整欄寫回
+        col = col.copy()
+        col.iat[idx] = value
+        df[name] = col
+
+def editor_key():
+    """Tab 3 表格目前使用的元件鍵"""
+    return f"pool_editor_{st.session_state['editor_version']}"
+
+def bump_editor_version():
+    """換掉 Tab 3 表格的鍵並丟棄舊鍵的編輯狀態，下次重跑以題庫目前的內容重建表格"""
+    st.session_state.pop(editor_key(), None)
+    st.session_state['editor_version'] += 1
+
+def clear_pool():
+    st.session_state['question_pool'] = []
+    st.session_state['pool_df'] = make_pool_frame([])
+    st.session_state['selected_ids'] = set()
+    st.session_state['image_store'] = {}
+    st.session_state['delete_ids'] = set()
+
+def apply_editor_changes(key, qids):
+    """Tab 3 表格送出時，只把有變更的列寫回題庫、selected_ids 與 delete_ids
+
+    key: 送出的表格元件鍵 (見 editor_key)
+    qids: 表格各列對應的題目 id (與送出前畫面上的列順序相同)
+    """
+    edited_rows = st.session_state.get(key, {}).get('edited_rows')
+    if not edited_rows:
+        return
+    bump_editor_version()
+    pool = st.session_state['question_pool']
+    pos = {q.id: i for i, q in enumerate(pool)}
+    selected_ids = st.session_state['selected_ids']
+    delete_ids = st.session_state['delete_ids']
+    for row, changes in edited_rows.items():
+        qid = qids[int(row)]
+        idx = pos.get(qid)
+        if idx is None:
+            continue
+        q = pool[idx]
+        if 'sel' in changes:
+            if changes['sel']:
+                selected_ids.add(qid)
+            else:
+                selected_ids.discard(qid)
+        if 'delete' in changes:
+            if changes['delete']:
+                delete_ids.add(qid)
+            else:
+                delete_ids.discard(qid)
+        if 'source' in changes:
+            q.source = changes['source']
+        if 'unit' in changes:
+            # 章節跟著單元走，避免表格中選出不屬於該章節的單元
+            q.unit = changes['unit']
+            q.chapter = UNIT_TO_CHAPTER.get(q.unit, q.chapter)
+        if 'answer' in changes:
+            q.answer = changes['answer'] or ""
+        # 篩選欄位只有來源、章節、單元；只改勾選或答案時不必複製整欄
+        if 'source' in changes or 'unit' in changes:
+            sync_pool_frame(idx)
+
+@st.cache_resource(show_spinner=False)
+def build_template_bytes():
+    """側邊欄下載用的 Word 匯入範本；內容固定，整個伺服器程序只建立一次"""
+    import docx
+
+    sample_doc = docx.Document()
+    sample_doc.add_paragraph("[Src:北模]")
+    sample_doc.add_paragraph("[Chap:第四章.電與磁的統一]")
+    sample_doc.add_paragraph("[Unit:4-1 電流磁效應]")
+    sample_doc.add_paragraph("[Type:Single]\n[Q]\n(範例) 設載流導線電流為 $I$，距離導線 $r$ 處的磁場強度 $B$ 為何？\n[Opt]\n(A) 正比於 r\n(B) 反比於 r\n[Ans] B")
+    sample_io = io.BytesIO()
+    sample_doc.save(sample_io)
+    return sample_io.getvalue()
+
+def reset_edit_widgets():
+    """清掉編輯元件的狀態，讓它們依目前檢視的題目重新初始化 (切換題目或儲存後呼叫)"""
+    for key in EDIT_WIDGET_KEYS:
+        st.session_state.pop(key, None)
+
+def save_question_edits(idx):
+    """「儲存修改」按鈕的 on_click：把編輯元件的值寫回第 idx 題"""
+    state = st.session_state
+    q = state['question_pool'][idx]
+    q.source = state['e_src']
+    q.chapter = state['e_chap']
+    q.unit = state['e_unit']
+    q.content = normalize_latex_delimiters(state['e_content'])
+    if 'e_opts' in state:
+        q.options = [normalize_latex_delimiters(line.strip()) for line in state['e_opts'].split('\n') if line.strip()]
+    q.answer = state['e_ans']
+    sync_pool_frame(idx)
+    reset_edit_widgets()
+    bump_editor_version()
+    st.toast("修改已儲存！")
+
+def apply_deletions():
+    """「刪除已標記的題目」按鈕的 on_click：一次刪除所有標記的題目"""
+    remove_from_pool(st.session_state['delete_ids'])
+    st.session_state['delete_ids'] = set()
+    reset_edit_widgets()
+    bump_editor_version()
+
+def reroll_seed():
+    """「重新亂數」按鈕的 on_click：在亂數種子輸入框建立前換一個新種子"""
+    st.session_state['shuffle_seed'] = random.randrange(2**32)
 
 # ==========================================
 # Streamlit 介面
@@ -322,7 +808,7 @@ with st.sidebar:
     
     if count > 0:
         if st.button("🗑️ 清空所有題目", type="primary"):
-            st.session_state['question_pool'] = []
+            clear_pool()
             st.rerun()
     
     st.divider()
@@ -337,16 +823,7 @@ with st.sidebar:
     - `[Ans] A` 答案
     """)
     
-    if st.button("📥 下載 Word 匯入範本"):
-        sample_doc = docx.Document()
-        sample_doc.add_paragraph("[Src:北模]")
-        sample_doc.add_paragraph("[Chap:第四章.電與磁的統一]")
-        sample_doc.add_paragraph("[Unit:4-1 電流磁效應]")
-        sample_doc.add_paragraph("[Type:Single]\n[Q]\n(範例) 設載流導線電流為 $I$，距離導線 $r$ 處的磁場強度 $B$ 為何？\n[Opt]\n(A) 正比於 r\n(B) 反比於 r\n[Ans] B")
-        sample_io = io.BytesIO()
-        sample_doc.save(sample_io)
-        sample_io.seek(0)
-        st.download_button("點此下載 .docx 範本", sample_io, "template_v3.docx")
+    st.download_button("📥 下載 Word 匯入範本", build_template_bytes, "template_v3.docx", DOCX_MIME, on_click="ignore")
 
 # --- 主畫面 ---
 tab1, tab2, tab3 = st.tabs(["✍️ 手動新增題目", "📁 從 Word 匯入", "🚀 選題與匯出"])
@@ -360,49 +837,58 @@ with tab1:
     with col_cat1:
         new_q_source = st.selectbox("來源", SOURCES)
     with col_cat2:
-        chap_list = list(PHYSICS_CHAPTERS.keys())
-        new_q_chap = st.selectbox("章節", chap_list)
+        new_q_chap = st.selectbox("章節", CHAPTER_NAMES)
     with col_cat3:
         unit_list = PHYSICS_CHAPTERS[new_q_chap]
         new_q_unit = st.selectbox("單元", unit_list)
 
-    c1, c2 = st.columns([1, 3])
-    with c1:
-        new_q_type = st.selectbox("題型", ["Single", "Multi", "Fill"], format_func=lambda x: {'Single':'單選題', 'Multi':'多選題', 'Fill':'填充題'}[x])
-    with c2:
+    new_q_type = st.selectbox("題型", ["Single", "Multi", "Fill"], format_func=lambda x: {'Single':'單選題', 'Multi':'多選題', 'Fill':'填充題'}[x])
+
+    # 文字輸入放在表單內，打字時不會每按一鍵就重跑整頁；
+    # 分類與題型留在表單外，因為單元清單與選項欄位要跟著即時變動
+    with st.form("new_q_form", clear_on_submit=False):
         new_q_ans = st.text_input("正確答案", placeholder="選擇題填代號(如 A)，填充題填文字")
 
-    new_q_content = st.text_area("題目內容 (支援 LaTeX)", height=100, placeholder="例如：求物體受力 $F = G \frac{Mm}{r^2}$ 的大小...")
-    
-    if "$" in new_q_content:
+        new_q_content = normalize_latex_delimiters(
+            st.text_area("題目內容 (支援 LaTeX)", height=100, placeholder="例如：求物體受力 $F = G \frac{Mm}{r^2}$ 的大小...")
+        )
+
+        new_q_image = st.file_uploader("上傳圖片 (選用)", type=['png', 'jpg', 'jpeg'])
+
+        new_q_options = []
+        if new_q_type in ["Single", "Multi"]:
+            opts_text = st.text_area("選項 (每一行一個選項)", height=150, placeholder="選項 A\n選項 B\n選項 C\n選項 D")
+            if opts_text:
+                new_q_options = [normalize_latex_delimiters(line.strip()) for line in opts_text.split('\n') if line.strip()]
+
+        col_btn1, col_btn2 = st.columns(2)
+        with col_btn1:
+            preview_clicked = st.form_submit_button("👁️ 預覽")
+        with col_btn2:
+            add_clicked = st.form_submit_button("➕ 加入題庫", type="secondary")
+
+    if preview_clicked and new_q_content:
         st.markdown("**預覽效果：**")
         st.markdown(new_q_content)
-    
-    new_q_image = st.file_uploader("上傳圖片 (選用)", type=['png', 'jpg', 'jpeg'])
-    
-    new_q_options = []
-    if new_q_type in ["Single", "Multi"]:
-        opts_text = st.text_area("選項 (每一行一個選項)", height=150, placeholder="選項 A\n選項 B\n選項 C\n選項 D")
-        if opts_text:
-            new_q_options = [line.strip() for line in opts_text.split('\n') if line.strip()]
+        for letter, opt in zip(LETTERS, new_q_options):
+            st.markdown(f"({letter}) {opt}")
 
-    if st.button("➕ 加入題庫", type="secondary"):
+    if add_clicked:
         if not new_q_content:
             st.error("請輸入題目內容")
         elif new_q_type != 'Fill' and not new_q_options:
             st.error("選擇題必須提供選項")
         else:
-            q_id = len(st.session_state['question_pool']) + 1
             img_bytes = new_q_image.getvalue() if new_q_image else None
 
             new_q = Question(
-                new_q_type, new_q_content, new_q_options, new_q_ans, q_id, 
+                new_q_type, new_q_content, new_q_options, new_q_ans, 
                 image_data=img_bytes, 
                 source=new_q_source, 
                 chapter=new_q_chap, 
                 unit=new_q_unit
             )
-            st.session_state['question_pool'].append(new_q)
+            add_to_pool([new_q])
             st.success(f"已加入題目！分類：{new_q_source} / {new_q_unit}")
 
 # === Tab 2: Word 匯入 ===
@@ -414,9 +900,9 @@ with tab2:
     if uploaded_file:
         if st.button("解析並加入題庫"):
             try:
-                imported_qs = parse_docx(uploaded_file.read())
+                imported_qs = parse_docx(uploaded_file)
                 if imported_qs:
-                    st.session_state['question_pool'].extend(imported_qs)
+                    add_to_pool(imported_qs)
                     st.success(f"成功匯入 {len(imported_qs)} 題！")
                 else:
                     st.warning("未偵測到題目，請檢查 Word 檔內的標籤格式。")
@@ -445,7 +931,6 @@ with tab3:
         
         # 使用 Columns 排版讓畫面不要太長
         # 將章節分兩欄顯示
-        chap_keys = list(PHYSICS_CHAPTERS.keys())
         col_c1, col_c2 = st.columns(2)
         
         for i, (chap, units) in enumerate(PHYSICS_CHAPTERS.items()):
@@ -467,137 +952,170 @@ with tab3:
                     if is_chap_all or is_unit_checked:
                         selected_units.add(unit)
 
-        # 3. 執行篩選
-        display_pool = []
+        # 3. 執行篩選 (對 pool_df 欄位做向量化比對)
+        pool = st.session_state['question_pool']
+        df = st.session_state['pool_df']
         has_unit_filter = (len(selected_units) > 0) or (len(selected_chapters) > 0)
         has_src_filter = (len(filter_src) > 0)
 
-        for i, q in enumerate(st.session_state['question_pool']):
+        if has_src_filter or has_unit_filter:
+            # category 欄位的 isin 只比對整數代碼；取出 numpy 布林陣列後再合併，省去 Series 的索引對齊
+            mask = np.ones(len(df), dtype=bool)
             # 來源篩選
-            src_match = (not has_src_filter) or (q.source in filter_src)
-            
+            if has_src_filter:
+                mask &= df['source'].isin(filter_src).to_numpy()
+
             # 單元篩選
             # 邏輯：(沒有勾選任何單元 = 全顯示) OR (題目單元在勾選名單中) OR (題目章節被全選)
-            if not has_unit_filter:
-                unit_match = True
-            else:
-                unit_in_list = q.unit in selected_units
-                chap_in_list = q.chapter in selected_chapters
-                unit_match = unit_in_list or chap_in_list
-            
-            if src_match and unit_match:
-                display_pool.append((i, q))
+            if has_unit_filter:
+                mask &= df['unit'].isin(selected_units).to_numpy() | df['chapter'].isin(selected_chapters).to_numpy()
+
+            display_pool = [(i, pool[i]) for i in np.flatnonzero(mask).tolist()]
+        else:
+            mask = None
+            display_pool = list(enumerate(pool))
 
         st.write(f"符合條件：{len(display_pool)} / 總題數：{len(st.session_state['question_pool'])}")
 
-        col_ctrl, _ = st.columns([2, 8])
-        with col_ctrl:
-            select_all = st.checkbox("全選符合條件的題目", value=True)
-        
-        selected_final_indices = []
+        # 勾選狀態存放在 selected_ids，全選 / 取消全選只需更新集合
+        selected_ids = st.session_state['selected_ids']
+        delete_ids = st.session_state['delete_ids']
+        col_all, col_none, _ = st.columns([2, 2, 6])
+        with col_all:
+            if st.button("✅ 全選符合條件的題目"):
+                selected_ids.update(q.id for _, q in display_pool)
+                bump_editor_version()
+        with col_none:
+            if st.button("⬜ 取消全選"):
+                selected_ids.difference_update(q.id for _, q in display_pool)
+                bump_editor_version()
         
         st.write("---")
         
-        # 顯示題目列表
-        for original_idx, q in display_pool:
-            col_check, col_text = st.columns([0.5, 9.5])
-            with col_check:
-                is_checked = st.checkbox("選", value=select_all, key=f"sel_{original_idx}", label_visibility="collapsed")
-                if is_checked:
-                    selected_final_indices.append(original_idx)
-            
-            with col_text:
-                type_badge = {'Single': '🟢單選', 'Multi': '🔵多選', 'Fill': '🟠填充'}.get(q.type, '⚪未知')
-                tags = f"[{q.source}] {q.unit}"
-                preview_content = q.content.strip()
-                preview_title = preview_content.splitlines()[0][:20] if preview_content else "(無內容)"
+        # 題目列表以單一表格呈現 (表格會虛擬捲動，不必為每題建立一組元件)；
+        # 放在表單內，勾選與修改累積到按下送出才一次寫回。
+        # 列對應的題目改變時 (篩選、新增、刪除) 換一個表格鍵，舊的列編輯不會套到錯的題目。
+        editor_qids = tuple(q.id for _, q in display_pool)
+        if editor_qids != st.session_state['editor_qids']:
+            st.session_state['editor_qids'] = editor_qids
+            bump_editor_version()
+        editor_data = {
+            'sel': [q.id in selected_ids for _, q in display_pool],
+            'delete': [q.id in delete_ids for _, q in display_pool],
+            'no': [i + 1 for i, _ in display_pool],
+            'source': [q.source for _, q in display_pool],
+            'unit': [q.unit for _, q in display_pool],
+            'type': [Q_TYPE_BADGE.get(q.type, '⚪未知') for _, q in display_pool],
+            'preview': [q.preview or "(無內容)" for _, q in display_pool],
+            'answer': [q.answer for _, q in display_pool],
+        }
+        if not editor_qids:
+            # 空表格推斷不出勾選欄的布林型別，data_editor 會報錯，改顯示提示
+            st.info("沒有符合篩選條件的題目。")
+        else:
+            with st.form("select_form"):
+                st.data_editor(
+                    editor_data,
+                    column_config={
+                        'sel': st.column_config.CheckboxColumn("匯出"),
+                        'delete': st.column_config.CheckboxColumn("刪除"),
+                        'no': st.column_config.NumberColumn("題號", disabled=True),
+                        'source': st.column_config.SelectboxColumn("來源", options=SOURCES, required=True),
+                        'unit': st.column_config.SelectboxColumn("單元", options=ALL_UNITS, required=True),
+                        'type': st.column_config.TextColumn("題型", disabled=True),
+                        'preview': st.column_config.TextColumn("題目", disabled=True),
+                        'answer': st.column_config.TextColumn("答案"),
+                    },
+                    hide_index=True,
+                    num_rows="fixed",
+                    key=editor_key(),
+                )
+                st.form_submit_button("☑️ 套用表格變更", on_click=apply_editor_changes, args=(editor_key(), editor_qids))
+
+        # 標記的題目累積到按下按鈕時才一次刪除，不必每刪一題就重建整個列表
+        st.button(f"🗑️ 刪除已標記的題目 ({len(delete_ids)} 題)", disabled=not delete_ids,
+                  on_click=apply_deletions)
+        
+        # 詳細內容只顯示一題 (檢視 / 編輯需要各自的按鈕，無法放在表單內)；
+        # 以表格的「題號」指定，不必每次重跑都為每一題組出選單標籤
+        if display_pool:
+            # 刪除題目後原本的題號可能超出題庫大小，建立輸入框前先夾回範圍內
+            if st.session_state.get('focus_no', 1) > len(pool):
+                st.session_state['focus_no'] = len(pool)
+            focus_no = st.number_input("📄 檢視 / 編輯題號", min_value=1, max_value=len(pool), step=1, key='focus_no')
+            original_idx = focus_no - 1
+            if mask is not None and not mask[original_idx]:
+                # 該題不在篩選結果中 (例如剛換了篩選條件)，改顯示篩選結果的第一題
+                original_idx = display_pool[0][0]
+                st.caption(f"第 {focus_no} 題不符合篩選條件，改顯示第 {original_idx + 1} 題。")
+            q = pool[original_idx]
+            # 編輯元件的鍵固定，會沿用上一題的值；檢視的題目一換 (含篩選或刪除後自動跳到別題) 就重新初始化
+            if st.session_state.get('edit_qid') != q.id:
+                reset_edit_widgets()
+                st.session_state['edit_qid'] = q.id
+            with st.container(border=True):
+                # === 編輯模式切換 ===
+                is_editing = st.checkbox(f"✏️ 編輯模式", key='edit_mode')
                 
-                with st.expander(f"{original_idx+1}. {tags} | {type_badge} | {preview_title}..."):
-                    # === 編輯模式切換 ===
-                    is_editing = st.checkbox(f"✏️ 編輯模式", key=f"edit_{original_idx}")
-                    
-                    if is_editing:
-                        # 顯示編輯表單
-                        with st.container(border=True):
-                            st.caption("編輯題目屬性")
-                            # 第一列：分類標籤
-                            ec1, ec2, ec3 = st.columns(3)
-                            
-                            # 來源
-                            try:
-                                src_idx = SOURCES.index(q.source)
-                            except ValueError:
-                                src_idx = 0
-                            new_src = ec1.selectbox("來源", SOURCES, index=src_idx, key=f"e_src_{original_idx}")
-                            
-                            # 章節
-                            chap_keys = list(PHYSICS_CHAPTERS.keys())
-                            try:
-                                chap_idx = chap_keys.index(q.chapter)
-                            except ValueError:
-                                chap_idx = 0
-                            new_chap = ec2.selectbox("章節", chap_keys, index=chap_idx, key=f"e_chap_{original_idx}")
-                            
-                            # 單元 (隨章節連動)
-                            unit_list = PHYSICS_CHAPTERS[new_chap]
-                            try:
-                                unit_idx = unit_list.index(q.unit)
-                            except ValueError:
-                                unit_idx = 0
-                            new_unit = ec3.selectbox("單元", unit_list, index=unit_idx, key=f"e_unit_{original_idx}")
-                            
-                            # 第二列：內容與答案
-                            new_content = st.text_area("題目內容 (支援 LaTeX)", value=q.content, height=150, key=f"e_content_{original_idx}")
-                            
-                            new_options = q.options
-                            if q.type != 'Fill':
-                                opts_text = "\n".join(q.options)
-                                new_opts_text = st.text_area("選項 (每行一個)", value=opts_text, height=100, key=f"e_opts_{original_idx}")
-                                new_options = [line.strip() for line in new_opts_text.split('\n') if line.strip()]
-                                
-                            new_ans = st.text_input("答案", value=q.answer, key=f"e_ans_{original_idx}")
+                if is_editing:
+                    # 顯示編輯表單
+                    with st.container(border=True):
+                        st.caption("編輯題目屬性")
+                        # 第一列：分類標籤
+                        ec1, ec2, ec3 = st.columns(3)
+                        
+                        # 來源
+                        ec1.selectbox("來源", SOURCES, index=SOURCE_INDEX.get(q.source, 0), key='e_src')
+                        
+                        # 章節
+                        new_chap = ec2.selectbox("章節", CHAPTER_NAMES, index=CHAPTER_INDEX.get(q.chapter, 0), key='e_chap')
+                        
+                        # 單元 (隨章節連動)
+                        unit_list = PHYSICS_CHAPTERS[new_chap]
+                        ec3.selectbox("單元", unit_list, index=UNIT_INDEX[new_chap].get(q.unit, 0), key='e_unit')
+                        
+                        # 第二列：內容與答案
+                        st.text_area("題目內容 (支援 LaTeX)", value=q.content, height=150, key='e_content')
+                        
+                        if q.type != 'Fill':
+                            opts_text = "\n".join(q.options)
+                            st.text_area("選項 (每行一個)", value=opts_text, height=100, key='e_opts')
                             
-                            if st.button("💾 儲存修改", key=f"save_{original_idx}"):
-                                q.source = new_src
-                                q.chapter = new_chap
-                                q.unit = new_unit
-                                q.content = new_content
-                                q.options = new_options
-                                q.answer = new_ans
-                                st.success("修改已儲存！請重新展開此題以查看更新後的標題。")
-                                st.rerun()
-                    else:
-                        # 顯示預覽模式 (原內容)
-                        st.caption(f"分類：{q.chapter} > {q.unit}")
-                        st.markdown("**題目**：")
-                        st.markdown(q.content if q.content else "*(題目內容為空)*")
+                        st.text_input("答案", value=q.answer, key='e_ans')
                         
-                        if q.image_data:
-                            st.image(q.image_data, caption="題目附圖", width=300)
-                        if q.options:
-                            for idx, opt in enumerate(q.options):
-                                st.text(f"({chr(65+idx)}) {opt}")
-                        st.markdown(f"**答案**：`{q.answer}`")
+                        st.button("💾 儲存修改", on_click=save_question_edits, args=(original_idx,))
+                else:
+                    # 顯示預覽模式 (原內容)
+                    st.caption(f"分類：{q.chapter} > {q.unit}")
+                    st.markdown("**題目**：")
+                    st.markdown(q.content if q.content else "*(題目內容為空)*")
                     
-                    if st.button("🗑️ 刪除此題", key=f"del_{original_idx}"):
-                        st.session_state['question_pool'].pop(original_idx)
-                        st.rerun()
+                    if q.image_data:
+                        st.image(load_thumbnail(q.image_data), caption="題目附圖", width=THUMB_SIZE)
+                    if q.options:
+                        for idx, opt in enumerate(q.options):
+                            st.text(OPT_PREFIXES[idx] + opt)
+                    st.markdown(f"**答案**：`{q.answer}`")
 
         st.divider()
-        st.write(f"已勾選匯出: **{len(selected_final_indices)}** 題")
+        final_qs = [q for _, q in display_pool if q.id in selected_ids]
+        st.write(f"已勾選匯出: **{len(final_qs)}** 題")
         
         col_set1, col_set2 = st.columns(2)
         with col_set1:
             exam_title_input = st.text_input("試卷標題", value="高中物理科 段考題")
         with col_set2:
             do_shuffle = st.checkbox("啟用選項亂數重排", value=True)
+            # 相同種子會得到相同的選項順序 (並直接取用快取的試卷)；填入舊種子即可重現先前的試卷
+            st.number_input("亂數種子", min_value=0, max_value=2**32 - 1, step=1, key='shuffle_seed',
+                            disabled=not do_shuffle)
+            st.button("🎲 重新亂數", disabled=not do_shuffle, on_click=reroll_seed)
         
-        if st.button("🚀 生成 Word 試卷", type="primary", disabled=len(selected_final_indices)==0):
-            final_qs = [st.session_state['question_pool'][i] for i in selected_final_indices]
-            exam_file, ans_file = generate_word_files(final_qs, shuffle=do_shuffle, title=exam_title_input)
-            
-            col_d1, col_d2 = st.columns(2)
-            with col_d1:
-                st.download_button("📄 下載試題卷 (Word)", exam_file, "物理試題卷.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
-            with col_d2:
-                st.download_button("🔑 下載詳解卷 (Word)", ans_file, "物理詳解卷.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        # 試卷在按下下載時才生成 (相同設定直接取用快取)，平常重跑不必把兩份 docx 留在記憶體裡
+        col_d1, col_d2 = st.columns(2)
+        with col_d1:
+            st.download_button("📄 下載試題卷 (Word)", deferred_export(0, final_qs, do_shuffle, exam_title_input, st.session_state['shuffle_seed']),
+                               "物理試題卷.docx", DOCX_MIME, type="primary", disabled=len(final_qs)==0, on_click="ignore")
+        with col_d2:
+            st.download_button("🔑 下載詳解卷 (Word)", deferred_export(1, final_qs, do_shuffle, exam_title_input, st.session_state['shuffle_seed']),
+                               "物理詳解卷.docx", DOCX_MIME, disabled=len(final_qs)==0, on_click="ignore")